@@ -1,22 +1,48 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+import itertools
 import os
-from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+import time
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, TEXT
 from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
 
 # Shared columns allowed for sorting/searching
 COLUMNS = ["id", "name", "position", "office", "age", "start_date", "salary"]
+# Default projection for the people collection: only the shared columns, so extra
+# fields never leave the server. Other collections just drop _id.
+DEFAULT_PROJECTION: Dict[str, int] = {"_id": 0, **{col: 1 for col in COLUMNS}}
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB = os.getenv("MONGO_DB", "datatables_demo")
 MONGO_COLL = os.getenv("MONGO_COLLECTION", "people")
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy")
+
+# Server-side time limit for page and count queries, so a slow scan can't hold
+# a pooled connection indefinitely
+QUERY_MAX_TIME_MS = 5000
 
 _client: Optional[MongoClient] = None
 
+# Estimated document counts: name -> (monotonic timestamp, count). Only the default
+# collection is cached, since other names come straight from client requests
+COUNT_CACHE_TTL = 5.0
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
 
 def get_client() -> MongoClient:
     global _client
     if _client is None:
-        _client = MongoClient(MONGO_URI, tz_aware=False)
+        # One pooled client per process, sized for concurrent requests from
+        # worker threads; compression applies when the server supports it
+        _client = MongoClient(
+            MONGO_URI,
+            tz_aware=False,
+            maxPoolSize=200,
+            minPoolSize=20,
+            waitQueueTimeoutMS=2500,
+            socketTimeoutMS=10000,
+            compressors=MONGO_COMPRESSORS,
+        )
     return _client
 
 
@@ -27,47 +53,135 @@ def get_collection(collection: Optional[str] = None) -> Collection:
 
 def ensure_indexes() -> None:
     coll = get_collection()
-    # Unique index on id for stable ordering and avoiding duplicates
-    coll.create_index([("id", ASCENDING)], unique=True)
-    # Helpful indexes for common sorts
-    coll.create_index([("name", ASCENDING)])
-    coll.create_index([("position", ASCENDING)])
-    coll.create_index([("office", ASCENDING)])
-    coll.create_index([("age", ASCENDING)])
-    coll.create_index([("start_date", ASCENDING)])
-    coll.create_index([("salary", ASCENDING)])
-    # Text index for fast global search across string fields
+    indexes = [
+        # Unique index on id for stable ordering and avoiding duplicates
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Compound (column, id) indexes in ESR order: serve equality filters on the
+        # column sorted by id as well as sorts on the column itself
+        *(IndexModel([(col, ASCENDING), ("id", ASCENDING)]) for col in COLUMNS if col != "id"),
+    ]
+    # Text index for fast global search across string fields; no language means
+    # no stemming or stop words, so tokens like "DevOps" or "Berlin" match as typed
+    text_index = IndexModel(
+        [("name", TEXT), ("position", TEXT), ("office", TEXT), ("start_date", TEXT)],
+        name="_text_all",
+        default_language="none",
+    )
+    # One createIndexes command for everything; if the text index already exists
+    # with different options the whole command fails, so retry without it
     try:
-        coll.create_index([("name", TEXT), ("position", TEXT), ("office", TEXT), ("start_date", TEXT)], name="_text_all")
-    except Exception:
-        pass
+        coll.create_indexes([*indexes, text_index])
+    except OperationFailure:
+        coll.create_indexes(indexes)
+
+
+# Largest integer BSON can encode (signed 64-bit)
+_MAX_BSON_INT = 2**63 - 1
+
+
+def _search_id(search: str) -> Optional[int]:
+    # Purely numeric input that fits in a BSON int is treated as an id
+    if search.isdecimal():
+        n = int(search)
+        if n <= _MAX_BSON_INT:
+            return n
+    return None
 
 
 def _build_filter(search: str) -> Dict[str, Any]:
+    search = search.strip()
     if not search:
         return {}
-    # Prefer MongoDB text search for string content; supports stemming and can use text index.
-    flt: Dict[str, Any] = {"$text": {"$search": search}}
-    # If search is purely numeric, augment with numeric equality across numeric fields
-    try:
-        n = int(search)
-        flt = {"$or": [flt, {"id": n}, {"age": n}, {"salary": n}]}
-    except ValueError:
-        pass
-    return flt
+    # Numeric input is an id lookup served by the unique id index
+    n = _search_id(search)
+    if n is not None:
+        return {"id": n}
+    # A single character is too short to search on; treat it as no filter so the
+    # page and count_filtered's total agree
+    if len(search) < 2:
+        return {}
+    # Otherwise use MongoDB text search, which can use the text index; "none"
+    # matches the index's language and skips stemming on the query side too
+    return {"$text": {"$search": search, "$language": "none", "$caseSensitive": False}}
 
 
 def count_all(collection: Optional[str] = None) -> int:
+    # Served from a short-lived cache; the total only feeds the DataTables info line
+    name = collection or MONGO_COLL
+    if name != MONGO_COLL:
+        return _catalog_count(get_collection(name))
+    cached = _count_cache.get(name)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < COUNT_CACHE_TTL:
+        return cached[1]
+    total = _catalog_count(get_collection(name))
+    _count_cache[name] = (now, total)
+    return total
+
+
+def _catalog_count(coll: Collection) -> int:
+    # $collStats reads the count from collection metadata in one command; it
+    # returns one document per shard on sharded clusters
+    try:
+        return sum(doc.get("count", 0) for doc in coll.aggregate([{"$collStats": {"count": {}}}]))
+    except OperationFailure:
+        # e.g. views, which have no storage stats
+        return coll.estimated_document_count()
+
+
+def invalidate_count_cache(collection: Optional[str] = None) -> None:
+    """Drop the cached total for a collection, or for all collections if none is given."""
+    if collection is None:
+        _count_cache.clear()
+    else:
+        _count_cache.pop(collection, None)
+
+
+def count_filtered(
+    search: str,
+    collection: Optional[str] = None,
+    raw_query: Optional[Dict[str, Any]] = None,
+) -> int:
     coll = get_collection(collection)
-    return coll.estimated_document_count()
+    if raw_query is not None:
+        return _count(coll, raw_query)
+    search = search.strip()
+    n = _search_id(search)
+    if n is not None:
+        # id is only known to be unique (ensure_indexes) in the default collection;
+        # there an exact match is 0 or 1 and a unique-index probe beats a count
+        if collection in (None, MONGO_COLL):
+            return 1 if coll.find_one({"id": n}, {"_id": 1}) else 0
+        return _count(coll, {"id": n})
+    # Empty or single-character searches apply no filter (see _build_filter), so
+    # report the (cached) total rather than running a count
+    if len(search) < 2:
+        return count_all(collection)
+    return coll.count_documents(_build_filter(search), maxTimeMS=QUERY_MAX_TIME_MS)
 
 
-def count_filtered(search: str) -> int:
-    coll = get_collection()
-    flt = _build_filter(search)
+def _count(coll: Collection, flt: Dict[str, Any]) -> int:
     if not flt:
-        return coll.estimated_document_count()
-    return coll.count_documents(flt)
+        return count_all(coll.name)
+    return coll.count_documents(flt, maxTimeMS=QUERY_MAX_TIME_MS)
+
+
+def _default_projection(collection: Optional[str]) -> Dict[str, int]:
+    if collection is None or collection == MONGO_COLL:
+        return DEFAULT_PROJECTION
+    return {"_id": 0}
+
+
+def _sort_keys(order_column: Optional[str], order_dir: str) -> List[Tuple[str, int]]:
+    # Sort: allow arbitrary field when custom query/collection is used
+    sort_col = order_column if order_column else "id"
+    sort_dir = DESCENDING if order_dir == "desc" else ASCENDING
+    # id breaks ties so pages are deterministic; it follows the sort direction so
+    # the (column, id) compound index can serve the sort forwards or backwards
+    sort_keys = [(sort_col, sort_dir)]
+    if sort_col != "id":
+        sort_keys.append(("id", sort_dir))
+    return sort_keys
 
 
 def find_page(
@@ -79,50 +193,81 @@ def find_page(
     collection: Optional[str] = None,
     raw_query: Optional[Dict[str, Any]] = None,
     projection: Optional[Dict[str, int]] = None,
-) -> Tuple[List[Dict[str, Any]], int]:
+    sort_by_score: bool = False,
+) -> List[Dict[str, Any]]:
     """
-    Find a page of documents. If raw_query is provided, it overrides the default
+    Find a page of documents; pair it with count_filtered for recordsFiltered. If raw_query is provided, it overrides the default
     search-based filter. You can also specify a collection name and projection.
+    Text-score ordering is only applied when sort_by_score is set and the filter
+    is a $text search; if the filter has no text score, results fall back to id
+    order. Without sort_by_score, order_column is used.
     """
+    # PyMongo treats limit(0) as "no limit"; only -1 may ask for every row
+    if length == 0 or length < -1:
+        raise ValueError(f"length must be positive or -1, got {length}")
     coll = get_collection(collection)
     flt = raw_query if raw_query is not None else _build_filter(search)
 
-    # Sort: allow arbitrary field when custom query/collection is used
-    sort_col = order_column if order_column else "id"
-    sort_dir = DESCENDING if order_dir == "desc" else ASCENDING
+    sort_keys = _sort_keys(None if sort_by_score else order_column, order_dir)
+    proj = projection if projection is not None else _default_projection(collection)
 
-    proj = projection if projection is not None else {"_id": 0}
-
-    # Build aggregation pipeline to fetch page and filtered count in one round trip
-    pipeline: List[Dict[str, Any]] = []
-    if flt:
-        pipeline.append({"$match": flt})
-    # If sorting by text score, project score; else regular sort
-    sort_stage: Dict[str, Any]
-    if isinstance(flt, dict) and "$text" in flt and sort_col in (None, "score"):
-        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
-        sort_stage = {"score": -1}
-    else:
-        sort_stage = {sort_col: -1 if sort_dir == DESCENDING else 1}
-    pipeline.append({"$sort": sort_stage})
-    pipeline.append({"$project": {**proj}})
-    facet: Dict[str, Any] = {
-        "data": [],
-        "meta": [{"$count": "recordsFiltered"}],
-    }
-    if start:
-        facet["data"].append({"$skip": start})
-    if length != -1:
-        facet["data"].append({"$limit": length})
-    pipeline.append({"$facet": facet})
-
-    agg_res = list(coll.aggregate(pipeline, allowDiskUse=True))
-    if agg_res:
-        res = agg_res[0]
-        data = res.get("data", [])
-        meta = res.get("meta", [])
-        filtered = meta[0].get("recordsFiltered", 0) if meta else (coll.estimated_document_count() if not flt else 0)
+    # find() sends the limit, which already caps its first batch at the page size,
+    # so only the score aggregation is given a batchSize matching the page;
+    # length=-1 keeps the driver's default batching
+    batch_size = length if length > 0 else None
+
+    if sort_by_score and "$text" in flt:
+        # Text-score ordering needs $meta, so keep the aggregation for this case only
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": flt},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+            {"$sort": {"score": -1, "id": 1}},
+        ]
+        if start:
+            pipeline.append({"$skip": start})
+        if length != -1:
+            pipeline.append({"$limit": length})
+        pipeline.append({"$project": {**proj}})
+        data = list(coll.aggregate(pipeline, batchSize=batch_size, maxTimeMS=QUERY_MAX_TIME_MS))
     else:
-        data, filtered = [], 0
+        # Plain find lets the planner use indexes for the match, sort and limit
+        cursor = coll.find(flt, proj).sort(sort_keys).max_time_ms(QUERY_MAX_TIME_MS)
+        if start:
+            cursor = cursor.skip(start)
+        if length != -1:
+            cursor = cursor.limit(length)
+        data = list(cursor)
+
+    return data
 
-    return data, filtered
+
+def iter_documents(
+    search: str,
+    order_column: Optional[str],
+    order_dir: str,
+    start: int = 0,
+    limit: int = 0,
+    collection: Optional[str] = None,
+    raw_query: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, int]] = None,
+    batch_size: int = 500,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream matching documents in the same order as find_page, fetching them in
+    batch_size batches so memory stays flat for exports. limit=0 means no limit.
+    No maxTimeMS is applied, since a full export legitimately runs long.
+    The first batch is fetched before returning, so a bad filter or connection
+    error raises here rather than partway through a streamed response.
+    """
+    coll = get_collection(collection)
+    flt = raw_query if raw_query is not None else _build_filter(search)
+    proj = projection if projection is not None else _default_projection(collection)
+    cursor = coll.find(flt, proj).sort(_sort_keys(order_column, order_dir)).batch_size(batch_size)
+    if start:
+        cursor = cursor.skip(start)
+    if limit:
+        cursor = cursor.limit(limit)
+    first = next(cursor, None)
+    if first is None:
+        return iter(())
+    return itertools.chain((first,), cursor)
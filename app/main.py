@@ -1,23 +1,38 @@
-from typing import List, Optional, Any, Dict
+import asyncio
+from typing import Iterator, List, Optional, Any, Dict
 
+import orjson
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
 
 # Strawberry (GraphQL schema 2)
 import strawberry
 from strawberry.asgi import GraphQL as StrawberryGraphQL
+from strawberry.dataloader import DataLoader
 
 # DB layer (Model)
-from app.db import find_page, count_all, count_filtered, COLUMNS, ensure_indexes
+from app.db import find_page, iter_documents, count_all, count_filtered, COLUMNS, ensure_indexes
 
 
 
+# Largest page a client may request
+MAX_LENGTH = 1000
+
+
 # -----------------------------
 # Shared server-side processing logic for DataTables
 # -----------------------------
 
+def build_search_haystacks(items: List[Dict[str, Any]]) -> List[str]:
+    """
+    Precompute one lowercased string per row for filter_sort_paginate. Build this
+    once when the list is loaded; values are NUL-joined so a match can't span fields.
+    """
+    return ["\x00".join(map(str, row.values())).lower() for row in items]
+
+
 def filter_sort_paginate(
     items: List[Dict[str, Any]],
     search_value: str,
@@ -25,13 +40,18 @@ def filter_sort_paginate(
     order_dir: str,
     start: int,
     length: int,
+    haystacks: Optional[List[str]] = None,
 ) -> (List[Dict[str, Any]], int):
     # Global search (case-insensitive) across stringified values
     if search_value:
         sv = search_value.lower()
-        filtered = [
-            row for row in items if any(sv in str(v).lower() for v in row.values())
-        ]
+        if haystacks is not None:
+            # Single substring scan per row over the precomputed strings
+            filtered = [row for row, hay in zip(items, haystacks) if sv in hay]
+        else:
+            filtered = [
+                row for row in items if any(sv in str(v).lower() for v in row.values())
+            ]
     else:
         filtered = list(items)
 
@@ -68,6 +88,14 @@ class Person:
     salary: int
 
 
+def _person_from_doc(doc: Dict[str, Any]) -> Person:
+    # Documents are already projected to Person's fields, so fill the instance
+    # dict directly instead of going through the dataclass __init__ keyword dispatch
+    person = Person.__new__(Person)
+    person.__dict__.update(doc)
+    return person
+
+
 @strawberry.type
 class PersonPage:
     records: List[Person]
@@ -75,23 +103,48 @@ class PersonPage:
     records_filtered: int
 
 
+async def _load_totals(collections: List[Optional[str]]) -> List[int]:
+    # One count per distinct collection, however many resolvers asked in this batch
+    totals = {name: await asyncio.to_thread(count_all, name) for name in set(collections)}
+    return [totals[name] for name in collections]
+
+
+class GraphQLWithLoaders(StrawberryGraphQL):
+    # DataLoaders are bound to the event loop they first run on, so each request
+    # gets its own; people fields in one document still share a single count
+    async def get_context(self, request, response):
+        context = await super().get_context(request, response)
+        context["total_records_loader"] = DataLoader(load_fn=_load_totals, max_batch_size=64)
+        return context
+
+
 @strawberry.type
 class StrawberryQuery:
     @strawberry.field
-    def people(
+    async def people(
         self,
+        info: strawberry.Info,
         search: str = "",
         order_column: str = "id",
         order_dir: str = "asc",
         start: int = 0,
         length: int = 10,
     ) -> PersonPage:
-        records, filtered_count = find_page(
-            search, order_column, order_dir, start, length
+        # No unbounded pages over GraphQL: -1 and oversized requests get MAX_LENGTH
+        length = MAX_LENGTH if length == -1 or length > MAX_LENGTH else max(1, length)
+        # Page fetch and both counts overlap instead of running back to back
+        records, filtered_count, total = await asyncio.gather(
+            asyncio.to_thread(
+                find_page, search, order_column, order_dir, start, length,
+                # orderColumn "score" asks for relevance ordering of text searches
+                sort_by_score=order_column == "score",
+            ),
+            asyncio.to_thread(count_filtered, search),
+            info.context["total_records_loader"].load(None),
         )
         return PersonPage(
-            records=[Person(**r) for r in records],
-            records_total=count_all(),
+            records=[_person_from_doc(r) for r in records],
+            records_total=total,
             records_filtered=filtered_count,
         )
 
@@ -103,26 +156,55 @@ strawberry_schema = strawberry.Schema(query=StrawberryQuery)
 # FastAPI setup
 # -----------------------------
 
-app = FastAPI(title="FastAPI + GraphQL (Strawberry) + DataTables Demo")
+app = FastAPI(
+    title="FastAPI + GraphQL (Strawberry) + DataTables Demo",
+    default_response_class=ORJSONResponse,
+)
 
-# Ensure indexes on startup using FastAPI event
-@app.on_event("startup")
-def _startup():
+def _ensure_indexes_quietly() -> None:
     try:
         ensure_indexes()
     except Exception:
         # Avoid crashing if Mongo is not up yet; endpoints will error on demand
         pass
 
+
+# Ensure indexes in the background on startup so the server accepts traffic
+# while they build; the task is kept on app.state so it isn't garbage collected
+@app.on_event("startup")
+async def _startup():
+    app.state.ensure_indexes_task = asyncio.create_task(asyncio.to_thread(_ensure_indexes_quietly))
+
 # Mount static directory for JS/CSS
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 
 # GraphQL endpoints
 # Strawberry endpoint (ASGI app with built-in playground)
-app.add_route("/graphql-strawberry", StrawberryGraphQL(schema=strawberry_schema))
+app.add_route("/graphql-strawberry", GraphQLWithLoaders(schema=strawberry_schema))
+
 
 
+# DataTables column order, resolved once rather than per request
+_COL_BY_IDX = tuple(COLUMNS)
+
+
+def _stream_datatable(
+    draw: int,
+    rows: Iterator[Dict[str, Any]],
+    total_records: int,
+    filtered_count: int,
+) -> Iterator[bytes]:
+    # One JSON document per line, then a final line with the DataTables counters.
+    # Sync generator: Starlette iterates it in a worker thread, off the event loop.
+    # default=str keeps BSON types orjson can't encode (ObjectId, Decimal128, ...)
+    # from cutting the stream short.
+    for doc in rows:
+        yield orjson.dumps(doc, default=str) + b"\n"
+    yield orjson.dumps(
+        {"draw": draw, "recordsTotal": total_records, "recordsFiltered": filtered_count}
+    ) + b"\n"
+
 
 # DataTables server-side processing endpoint
 @app.api_route("/datatable", methods=["GET", "POST"])
@@ -143,47 +225,65 @@ async def datatable(request: Request):
     draw = int(q.get("draw", 1))
     start = int(q.get("start", 0))
     length = int(q.get("length", 10))
+    if length < 1 and length != -1:
+        return ORJSONResponse(
+            {"draw": draw, "error": "length must be positive or -1"},
+            status_code=400,
+        )
 
     search_value = q.get("search[value]", "")
 
-    # Determine ordering from DataTables parameters
-    order_col_idx = q.get("order[0][column]")
+    # Determine ordering from DataTables parameters. The column index maps onto
+    # COLUMNS, in the same order the frontend declares its columns; anything
+    # missing or out of range falls back to id.
+    oi = q.get("order[0][column]")
     order_dir = q.get("order[0][dir]", "asc")
-
-    # Default ordering
-    order_column = "id"
-
-    # DataTables sends the columns list; we prefer to respect the client-provided mapping
-    try:
-        if order_col_idx is not None:
-            idx = int(order_col_idx)
-            # columns[idx][data] can be a column name string if configured in JS
-            order_column_candidate = q.get(f"columns[{idx}][data]")
-            if order_column_candidate in COLUMNS:
-                order_column = order_column_candidate
-            else:
-                # If not provided, fallback to predefined mapping by index
-                if 0 <= idx < len(COLUMNS):
-                    order_column = COLUMNS[idx]
-    except Exception:
-        pass
+    order_column = (
+        _COL_BY_IDX[int(oi)] if oi and oi.isdecimal() and int(oi) < len(_COL_BY_IDX) else "id"
+    )
 
     # Advanced Mongo options from body
     collection = body.get("collection")
     raw_query = body.get("query")
     projection = body.get("projection")
 
-    records, filtered_count = find_page(
-        search_value, order_column, order_dir, start, length,
-        collection=collection,
-        raw_query=raw_query,
-        projection=projection,
-    )
+    # Exports (length=-1) and pages above MAX_LENGTH are streamed as NDJSON rather
+    # than buffered into one response
+    if length == -1 or length > MAX_LENGTH:
+        # Open the cursor (first batch) and compute both counts before replying:
+        # once streaming starts the 200 is already sent and errors can't be reported
+        rows, filtered_count, total_records = await asyncio.gather(
+            asyncio.to_thread(
+                iter_documents,
+                search_value, order_column, order_dir, start,
+                limit=max(length, 0),
+                collection=collection,
+                raw_query=raw_query,
+                projection=projection,
+            ),
+            asyncio.to_thread(count_filtered, search_value, collection, raw_query),
+            asyncio.to_thread(count_all, collection),
+        )
+        return StreamingResponse(
+            _stream_datatable(draw, rows, total_records, filtered_count),
+            media_type="application/x-ndjson",
+        )
 
-    # Total records in the selected collection (ignores filtering)
-    total_records = count_all(collection)
+    # PyMongo is blocking; run the page query, the filtered count and the total
+    # (ignores filtering) off the event loop, concurrently
+    records, filtered_count, total_records = await asyncio.gather(
+        asyncio.to_thread(
+            find_page,
+            search_value, order_column, order_dir, start, length,
+            collection=collection,
+            raw_query=raw_query,
+            projection=projection,
+        ),
+        asyncio.to_thread(count_filtered, search_value, collection, raw_query),
+        asyncio.to_thread(count_all, collection),
+    )
 
-    return JSONResponse(
+    return ORJSONResponse(
         {
             "draw": draw,
             "recordsTotal": total_records,